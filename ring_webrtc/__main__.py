@@ -1,23 +1,21 @@
+from __future__ import annotations
+
 import argparse
 import logging
+import os
 from pathlib import Path
-import socket
-
-from systemd.daemon import listen_fds, is_socket
+import sys
 
-from aiohttp import web
-from ring_doorbell import (
-	Auth,
-	Ring,
-)
-from ring_doorbell.const import (
-	CLI_TOKEN_FILE,
-	USER_AGENT,
-)
+# annotations are not evaluated, these imports only serve type checkers
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+	import asyncio
+	import socket
+	from typing import Sequence
 
-from .middleware import IdleShutdown
-from .token_manager import TokenManager
-from .app import create_whep_app
+# aiohttp, ring_doorbell, systemd and the stdlib modules used only to serve
+# are imported where they are first needed so that argument parsing and
+# --help don't pay for them
 
 LOG_LEVELS = [logging.WARNING, logging.INFO, logging.DEBUG]
 
@@ -25,23 +23,179 @@ LOG_LEVELS = [logging.WARNING, logging.INFO, logging.DEBUG]
 def _get_systemd_sockets():
 	"""
 	Retrieve sockets passed by systemd.
-	Validates each socket to ensure it's suitable for the server.
+	The listening environment is cleared so child processes don't inherit it,
+	and each socket is made non-blocking and close-on-exec.
 	"""
 
-	fds = listen_fds()
+	import socket
+
+	from systemd.daemon import listen_fds
+
+	fds = listen_fds(unset_environment=True)
 	if not fds:
 		raise RuntimeError("No sockets were passed by systemd.")
 
+	# family and type are detected from the descriptor itself
+	sockets = [socket.socket(fileno=fd) for fd in fds]
+	for sock in sockets:
+		sock.setblocking(False)
+		os.set_inheritable(sock.fileno(), False)
+
+	return sockets
+
+
+def _create_reuseport_socket(address: str, port: int) -> socket.socket:
+	"""
+	Create a listening socket with SO_REUSEPORT set so that several
+	workers can bind the same address and let the kernel balance accepts.
+	"""
+
+	import socket
+
+	family, type_, proto, _, sockaddr = socket.getaddrinfo(
+		address, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE,
+	)[0]
+	sock = socket.socket(family, type_, proto)
+	sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+	sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+	sock.bind(sockaddr)
+	sock.listen()
+	sock.setblocking(False)
+	return sock
+
+
+def _new_event_loop() -> asyncio.AbstractEventLoop | None:
+	"""
+	Create a uvloop event loop when it is installed.
+	Returns None to let aiohttp create the default loop.
+	"""
+
+	try:
+		import uvloop
+	except ImportError:
+		logging.debug("uvloop is not installed, using the default event loop")
+		return None
+
+	logging.debug("Using uvloop event loop")
+	return uvloop.new_event_loop()
+
+
+def _serve(
+	args: argparse.Namespace,
+	sock: socket.socket | list[socket.socket] | None = None,
+	*,
+	worker: int | None = None,
+	worker_sockets: Sequence[str] = (),
+):
+	from aiohttp import web
+	from ring_doorbell import Auth, Ring
+	from ring_doorbell.const import USER_AGENT
+
+	from .app import create_whep_app
+	from .middleware import IdleShutdown
+	from .token_manager import SharedTokenAuth, TokenManager
+
+	token_manager = TokenManager(args.token_file, shared=worker is not None)
+
+	# Authenticate and create a Ring object
+	if worker is not None:
+		# workers share token refreshes through the token file
+		auth = SharedTokenAuth(token_manager, user_agent=USER_AGENT)
+	else:
+		auth = Auth(
+			user_agent=USER_AGENT,
+			token=token_manager.token,
+			token_updater=token_manager.update_token,
+		)
+	ring = Ring(auth)
+
+	app = create_whep_app(ring, worker=worker, worker_sockets=worker_sockets)
+
+	if args.timeout:
+		IdleShutdown(idle_timeout=args.timeout).setup(app)
+
+	loop = _new_event_loop()
+
+	if sock is not None:
+		web.run_app(app, sock=sock, loop=loop)
+	else:
+		web.run_app(app, host=args.address, port=args.port, loop=loop)
+
+
+def _pin_cpu(index: int):
+	"""
+	Pin the current process to a single CPU so packet delivery, accept and
+	socket reads/writes for its connections stay on the same core.
+	"""
+
+	cpus = sorted(os.sched_getaffinity(0))
+	cpu = cpus[index % len(cpus)]
+	os.sched_setaffinity(0, {cpu})
+	logging.info("Process %d pinned to CPU %d", os.getpid(), cpu)
+
+
+def _create_worker_socket(path: str) -> socket.socket:
+	"""
+	Create the private unix socket other workers forward session requests to.
+	"""
+
+	import socket
+
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	sock.bind(path)
+	sock.listen()
+	sock.setblocking(False)
+	return sock
+
+
+def _run_worker(args: argparse.Namespace, index: int, worker_sockets: Sequence[str]):
+	logging.basicConfig(level=args.log_level)
+	if args.pin_cpus:
+		_pin_cpu(index)
 	sockets = [
-		socket.socket(fileno=fd)
-		for fd in fds
-		if is_socket(fd, type=socket.SOCK_STREAM)
+		_create_reuseport_socket(args.address, args.port),
+		_create_worker_socket(worker_sockets[index]),
 	]
+	logging.info("Worker %d starting web application on %s:%d", index, args.address, args.port)
+	_serve(args, sockets, worker=index, worker_sockets=worker_sockets)
 
-	if not sockets:
-		raise RuntimeError("No valid stream sockets passed by systemd.")
 
-	return sockets
+def _run_workers(args: argparse.Namespace, count: int):
+	import multiprocessing
+	import shutil
+	import signal
+	import tempfile
+
+	runtime_dir = tempfile.mkdtemp(prefix='ring-webrtc-')
+	worker_sockets = [
+		os.path.join(runtime_dir, f'worker-{index}.sock')
+		for index in range(count)
+	]
+	workers = [
+		multiprocessing.Process(
+			target=_run_worker,
+			args=(args, index, worker_sockets),
+			name=f'ring-webrtc-worker-{index}',
+		)
+		for index in range(count)
+	]
+
+	for worker in workers:
+		worker.start()
+
+	# turn SIGTERM into SystemExit so the workers get torn down below
+	signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+	try:
+		for worker in workers:
+			worker.join()
+	finally:
+		for worker in workers:
+			if worker.is_alive():
+				worker.terminate()
+		for worker in workers:
+			worker.join()
+		shutil.rmtree(runtime_dir, ignore_errors=True)
 
 
 def main():
@@ -65,6 +219,17 @@ def main():
 		help='Use systemd socket activation.',
 		action='store_true',
 	)
+	parser.add_argument(
+		'-w', '--workers',
+		help='Number of worker processes sharing the listening port via SO_REUSEPORT. Use 0 for one per CPU. Ignored with --systemd.',
+		type=int,
+		default=1,
+	)
+	parser.add_argument(
+		'--pin-cpus',
+		help='Pin each worker process to its own CPU, or the single server process to the first allowed CPU.',
+		action='store_true',
+	)
 	parser.add_argument(
 		'-t', '--timeout',
 		help='Enable shutdown after <timeout> seconds of no activity.',
@@ -73,9 +238,8 @@ def main():
 	)
 	parser.add_argument(
 		'-f', '--token-file',
-		help='The file where the ring auth token is stored.',
+		help='The file where the ring auth token is stored. Defaults to the ring-doorbell CLI token file.',
 		type=Path,
-		default=Path(CLI_TOKEN_FILE),
 	)
 	parser.add_argument(
 		'-v', '--verbose',
@@ -86,34 +250,32 @@ def main():
 
 	args = parser.parse_args()
 
-	level = LOG_LEVELS[min(args.verbose, len(LOG_LEVELS) - 1)]  # cap to last level index
-	logging.basicConfig(level=level)
+	args.log_level = LOG_LEVELS[min(args.verbose, len(LOG_LEVELS) - 1)]  # cap to last level index
+	logging.basicConfig(level=args.log_level)
+
+	if args.token_file is None:
+		from ring_doorbell.const import CLI_TOKEN_FILE
+		args.token_file = Path(CLI_TOKEN_FILE)
 
 	if not args.token_file.is_file():
 		raise ValueError("Token file not found. Please run the ring-doorbell command to generate a token file.")
 
-	token_manager = TokenManager(args.token_file)
-
-	# Authenticate and create a Ring object
-	auth = Auth(
-		user_agent=USER_AGENT,
-		token=token_manager.token,
-		token_updater=token_manager.update_token,
-	)
-	ring = Ring(auth)
-
-	app = create_whep_app(ring)
-
-	if args.timeout:
-		IdleShutdown(idle_timeout=args.timeout).setup(app)
+	workers = args.workers or os.cpu_count() or 1
 
 	if args.systemd:
 		sockets = _get_systemd_sockets()
-		logging.info(f"Starting web application on systemd sockets")
-		web.run_app(app, sock=sockets)
+		logging.info("Starting web application on systemd sockets")
+		if args.pin_cpus:
+			_pin_cpu(0)
+		_serve(args, sockets)
+	elif workers > 1:
+		logging.info("Starting %d workers on %s:%d", workers, args.address, args.port)
+		_run_workers(args, workers)
 	else:
-		logging.info(f"Starting web application on {args.address}:{args.port}")
-		web.run_app(app, host=args.address, port=args.port)
+		logging.info("Starting web application on %s:%d", args.address, args.port)
+		if args.pin_cpus:
+			_pin_cpu(0)
+		_serve(args)
 
 if __name__ == '__main__':
 	main()
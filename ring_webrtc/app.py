@@ -1,23 +1,71 @@
 import asyncio
 import logging
-from dataclasses import dataclass
-from typing import Callable, Coroutine
+import re
+from contextlib import suppress
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Coroutine, Sequence
 
-from aiohttp import web
+from aiohttp import ClientSession, UnixConnector, web
 from ring_doorbell import Ring, RingDoorBell
-from ring_doorbell.webrtcstream import RingWebRtcStream
 
 from ring_webrtc.middleware import CREATE_TASK
 
-from .decorators import cleanup_ctx, periodic_updates
+from .decorators import periodic_cleanup_ctx
+from .helpers import now, sdp_session_id
 
 _LOGGER = logging.getLogger(__name__)
 
+_H265_RTPMAP_RE = re.compile(rb'^(a=rtpmap:\d+ )H265(/)', re.MULTILINE)
+
 
 @dataclass
 class RuntimeData:
 	ring_api: Ring
 	update_lock: asyncio.Lock
+	min_refresh_interval: timedelta = timedelta(minutes=1)
+	cameras_by_id: dict[str, RingDoorBell] = field(default_factory=dict)
+	last_attempt: datetime | None = None
+	refresh_task: asyncio.Task | None = None
+	# keyed by (device_id, session_id), session ids are only unique per camera
+	session_events: dict[tuple[str, str], asyncio.Event] = field(default_factory=dict)
+	worker: int | None = None
+	worker_sockets: Sequence[str] = ()
+
+	async def refresh_devices(self) -> None:
+		"""
+		Refresh the Ring devices and swap in a fresh device_id index.
+		"""
+		async with self.update_lock:
+			# counted from the attempt, not the success, so a failing Ring
+			# is retried at most once per min_refresh_interval
+			self.last_attempt = now()
+			_LOGGER.info('Updating Ring devices...')
+			await self.ring_api.async_update_devices()
+			# swap in a fresh index so readers never need the lock
+			self.cameras_by_id = {
+				camera.device_id: camera
+				for camera in self.ring_api.video_devices()
+			}
+			_LOGGER.info('Ring devices updated')
+
+	@property
+	def refreshing(self) -> bool:
+		return self.refresh_task is not None and not self.refresh_task.done()
+
+	def request_refresh(self) -> asyncio.Task:
+		"""
+		Start a device refresh, or return the one already in flight.
+		"""
+		if not self.refreshing:
+			self.refresh_task = asyncio.create_task(self.refresh_devices())
+		return self.refresh_task
+
+	def is_stale(self) -> bool:
+		return (
+			self.last_attempt is None
+			or now() - self.last_attempt > self.min_refresh_interval
+		)
 
 RUNTIME_DATA = web.AppKey('RUNTIME_DATA', RuntimeData)
 
@@ -25,29 +73,40 @@ RUNTIME_DATA = web.AppKey('RUNTIME_DATA', RuntimeData)
 def create_whep_app(
 	ring: Ring,
 	*,
-	update_interval: int=3600,
+	update_interval: int=86400,
 	backoff_interval: int=60,
+	min_refresh_interval: int=60,
+	worker: int | None = None,
+	worker_sockets: Sequence[str] = (),
 ):
+	"""
+	Create the WHEP application.
+
+	When running as one of several workers, `worker` is this worker's index and
+	`worker_sockets` holds the unix socket path of every worker by index. Session
+	URLs then carry the owning worker so requests can be forwarded to it.
+	"""
 	app = web.Application()
 
 	app[RUNTIME_DATA] = RuntimeData(
 		ring_api=ring,
 		update_lock=asyncio.Lock(),
+		min_refresh_interval=timedelta(seconds=min_refresh_interval),
+		worker=worker,
+		worker_sockets=worker_sockets,
 	)
 
 	app.router.add_view('/{device_id}/whep', WhepView)
 	app.router.add_view('/{device_id}/whep/{session_id}', WhepResourceView)
 
-	@cleanup_ctx
-	@periodic_updates(
+	# devices are refreshed on demand when a lookup misses, this only
+	# bounds how stale the index can get on a quiet deployment
+	@periodic_cleanup_ctx(
 		interval=update_interval,
 		backoff=backoff_interval,
 	)
 	async def update_devices(app: web.Application):
-		async with app[RUNTIME_DATA].update_lock:
-			_LOGGER.info('Updating Ring devices...')
-			await ring.async_update_devices()
-			_LOGGER.info('Ring devices updated')
+		await app[RUNTIME_DATA].request_refresh()
 
 	app.cleanup_ctx.append(update_devices)
 
@@ -64,11 +123,14 @@ class CameraDeviceView(web.View):
 		return self.request.match_info['device_id']
 
 	async def get_camera(self) -> RingDoorBell:
-		async with self.data.update_lock:
-			camera = next((
-				camera for camera in self.data.ring_api.video_devices()
-				if camera.device_id == self.device_id
-			), None)
+		camera = self.data.cameras_by_id.get(self.device_id)
+
+		# join a refresh that is already running even if the index is fresh,
+		# it may be about to add the camera we are looking for
+		if camera is None and (self.data.refreshing or self.data.is_stale()):
+			# shield so a cancelled request doesn't abort the shared refresh
+			await asyncio.shield(self.data.request_refresh())
+			camera = self.data.cameras_by_id.get(self.device_id)
 
 		if camera is None:
 			raise RuntimeError(f'No such camera "{self.device_id}" could be found')
@@ -78,25 +140,49 @@ class CameraDeviceView(web.View):
 
 class WhepView(CameraDeviceView):
 	async def post(self) -> web.Response:
-		offer = (await self.request.text()).replace('H265', 'H264')
-		session_id = RingWebRtcStream.get_sdp_session_id(offer)
-		assert session_id, 'Invalid SDP offer'
-
-		_LOGGER.info(f'Starting WebRTC session "{session_id}" for device "{self.device_id}"')
+		raw = await self.request.read()
+		if not raw.startswith(b'v=0'):
+			return web.Response(status=400, text='Invalid SDP offer')
 
-		async def check_session_exists(camera: RingDoorBell, session_id: str):
-			while session_id in camera._webrtc_streams:
-				await asyncio.sleep(60)
+		try:
+			session_id = sdp_session_id(raw)
+			if not session_id:
+				return web.Response(status=400, text='Invalid SDP offer')
+
+			if b'H265' in raw:
+				raw = _H265_RTPMAP_RE.sub(rb'\1H264\2', raw)
+			offer = raw.decode('utf-8')
+		except UnicodeDecodeError:
+			return web.Response(status=400, text='Invalid SDP offer')
+
+		_LOGGER.info('Starting WebRTC session "%s" for device "%s"', session_id, self.device_id)
+
+		async def check_session_exists(camera: RingDoorBell, session_id: str, closed: asyncio.Event):
+			# a DELETE wakes us straight away, the slow poll only catches
+			# sessions that were torn down on the Ring side
+			try:
+				while not closed.is_set() and session_id in camera._webrtc_streams:
+					with suppress(TimeoutError):
+						async with asyncio.timeout(60):
+							await closed.wait()
+			finally:
+				key = (self.device_id, session_id)
+				if self.data.session_events.get(key) is closed:
+					del self.data.session_events[key]
 
 		try:
 			camera = await self.get_camera()
 			answer = await camera.generate_webrtc_stream(offer, keep_alive_timeout=None)
 			if CREATE_TASK in self.request:
+				closed = self.data.session_events[(self.device_id, session_id)] = asyncio.Event()
 				self.request[CREATE_TASK](
-					check_session_exists(camera, session_id),
+					check_session_exists(camera, session_id, closed),
 				)
+			location = f'/{self.device_id}/whep/{session_id}'
+			if self.data.worker is not None:
+				location += f'?worker={self.data.worker}'
 			return web.Response(text=answer, status=201, headers={
-				'Location': f'/{self.device_id}/whep/{session_id}',
+				'Location': location,
 			})
 		except Exception:
 			_LOGGER.exception('Error starting WebRTC session')
@@ -107,12 +193,35 @@ class WhepResourceView(CameraDeviceView):
 	async def delete(self) -> web.Response:
 		session_id: str = self.request.match_info['session_id']
 
-		_LOGGER.info(f'Terminating WebRTC session "{session_id}" for device "{self.device_id}"')
+		_LOGGER.info('Terminating WebRTC session "%s" for device "%s"', session_id, self.device_id)
 
 		try:
+			owner = self.request.query.get('worker')
+			if owner is not None and owner != str(self.data.worker):
+				return await self.forward(owner)
+
 			camera = await self.get_camera()
+			if session_id not in camera._webrtc_streams:
+				return web.Response(status=404, text='Unknown WebRTC session')
+
 			await camera.close_webrtc_stream(session_id)
+			if (closed := self.data.session_events.pop((self.device_id, session_id), None)) is not None:
+				closed.set()
 			return web.Response(status=204)
 		except Exception:
-			_LOGGER.exception(f'Error deleting WebRTC session')
+			_LOGGER.exception('Error deleting WebRTC session')
 			return web.Response(status=500, text='Failed to terminate WebRTC session')
+
+	async def forward(self, owner: str) -> web.Response:
+		"""
+		Forward the request to the worker that owns the session.
+		"""
+		if not owner.isdigit() or int(owner) >= len(self.data.worker_sockets):
+			return web.Response(status=404, text='Unknown WebRTC session')
+		path = self.data.worker_sockets[int(owner)]
+
+		_LOGGER.debug('Forwarding %s %s to worker %s', self.request.method, self.request.rel_url, owner)
+
+		async with ClientSession(connector=UnixConnector(path)) as session:
+			async with session.request(self.request.method, f'http://localhost{self.request.rel_url}') as response:
+				return web.Response(status=response.status, text=await response.text())
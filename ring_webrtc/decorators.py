@@ -23,9 +23,10 @@ def cleanup_ctx(
 	return wrapper
 
 
-def periodic_updates(interval: float, backoff: float):
+def periodic_cleanup_ctx(interval: float, backoff: float):
 	"""
-	Decorator to run an async function periodically with retries on errors.
+	Decorator to run an async function periodically for the lifetime of an
+	app, with retries on errors. The result is suitable for app.cleanup_ctx.
 
 	Args:
 		interval (float): Interval between normal successful repetitions (in seconds).
@@ -33,18 +34,19 @@ def periodic_updates(interval: float, backoff: float):
 	"""
 	def decorator(
 		func: Callable[_P, Coroutine[Any, Any, Any]],
-	) -> Callable[_P, Coroutine[Any, Any, None]]:
+	) -> Callable[_P, AsyncGenerator[None, None]]:
 		@wraps(func)
-		async def wrapper(*args, **kwargs):
+		async def run(*args, **kwargs) -> None:
 			while True:
 				try:
 					await func(*args, **kwargs)
 				except asyncio.CancelledError:
 					raise
 				except Exception:
-					_LOGGER.exception(f'Error occurred while running "{func.__name__}": retrying in {backoff} seconds...')
+					_LOGGER.exception('Error occurred while running "%s": retrying in %s seconds...', func.__name__, backoff)
 					await asyncio.sleep(backoff)
 				else:
 					await asyncio.sleep(interval)
-		return wrapper
+
+		return cleanup_ctx(run)
 	return decorator
@@ -1,8 +1,9 @@
 from typing import (
-    Callable,
-    Self,
+    Any,
+    Coroutine,
 )
 import asyncio
+import inspect
 import signal
 from datetime import (
     datetime,
@@ -19,6 +20,20 @@ def now():
     return datetime.now(timezone.utc)
 
 
+def sdp_session_id(sdp: bytes) -> str | None:
+    """
+    Extract the session id from the origin (o=) line of a raw SDP body.
+
+    The origin line directly follows the version line, so only the
+    first few lines are inspected rather than the whole offer.
+    """
+    for line in sdp.split(b'\n', 3)[:3]:
+        if line.startswith(b'o='):
+            fields = line.split()
+            return fields[1].decode('ascii') if len(fields) > 1 else None
+    return None
+
+
 # Global shutdown function
 def shutdown(_: Application) -> None:
     """
@@ -31,68 +46,65 @@ def shutdown(_: Application) -> None:
 
 class TaskWaitGroup:
     """
-    Tracks active tasks and allows managing the group as a single unit.
+    Collects coroutines and runs them as a single unit on an asyncio.TaskGroup.
+
+    Coroutines are not started when they are added: they all start together
+    once run() is called, which the IdleShutdown middleware does when the
+    request handler returns. Work handed to CREATE_TASK therefore begins after
+    the response, not during the handler. Each coroutine runs independently,
+    a failure is logged and does not cancel the others.
     """
     def __init__(self) -> None:
-        self._tasks: set[asyncio.Task] = set()
+        self._coros: list[Coroutine[Any, Any, Any]] = []
         self._group_task: asyncio.Task | None = None
-        self._done_callbacks: list[Callable[[Self], object]] = []
 
     def __bool__(self) -> bool:
-        return bool(self._tasks)
+        return bool(self._coros)
 
     def __len__(self) -> int:
-        return len(self._tasks)
+        return len(self._coros)
 
-    def add(self, task: asyncio.Task) -> None:
+    def add(self, coro: Coroutine[Any, Any, Any]) -> None:
         """
-        Add a task to the wait group.
+        Add a coroutine to the wait group.
         """
         if self._group_task is not None:
             raise RuntimeError("Cannot add tasks to a running group.")
 
-        self._tasks.add(task)
-        _LOGGER.debug(f"Tracking new task: {task}. Total tasks: {len(self._tasks)}")
-
-    def remove(self, task: asyncio.Task) -> None:
-        """
-        Remove a task from the wait group.
-        """
-        if self._group_task is not None:
-            raise RuntimeError("Cannot remove tasks from a running group.")
-
-        self._tasks.discard(task)
-        _LOGGER.debug(f"Task removed: {task}. Remaining tasks: {len(self._tasks)}")
+        self._coros.append(coro)
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("Tracking new task: %s. Total tasks: %d", coro, len(self._coros))
 
     def run(self) -> asyncio.Task:
         """
-        Run all tasks in the group concurrently and optionally attach a callback.
+        Run all coroutines in the group concurrently.
         """
-        if self._group_task is not None:
-            return self._group_task
-
-        _LOGGER.debug(f"Running {len(self._tasks)} tasks concurrently.")
-        self._group_task = asyncio.create_task(
-            asyncio.wait(self._tasks, return_when=asyncio.ALL_COMPLETED)
-        )
-
-        self._group_task.add_done_callback(self._on_group_done)
+        if self._group_task is None:
+            _LOGGER.debug("Running %d tasks concurrently.", len(self._coros))
+            self._group_task = asyncio.create_task(self._run())
+            self._group_task.add_done_callback(self._on_group_done)
 
         return self._group_task
 
+    async def _run(self) -> None:
+        async with asyncio.TaskGroup() as tg:
+            for coro in self._coros:
+                tg.create_task(self._isolate(coro))
+
     def _on_group_done(self, _: asyncio.Task) -> None:
+        # close coroutines that never got to run, e.g. when the group was
+        # cancelled at shutdown, so they aren't reported as never awaited
+        for coro in self._coros:
+            if inspect.getcoroutinestate(coro) == inspect.CORO_CREATED:
+                coro.close()
         _LOGGER.debug("Task group completed.")
-        self._tasks.clear()
+        self._coros.clear()
         self._group_task = None
 
-        for callback in self._done_callbacks:
-            try:
-                callback(self)
-            except Exception:
-                _LOGGER.error(f'Error in task group callback')
-
-    def add_done_callback(self, callback: Callable[[Self], object]) -> None:
-        """
-        Add a callback to the group task.
-        """
-        self._done_callbacks.append(callback)
+    @staticmethod
+    async def _isolate(coro: Coroutine[Any, Any, Any]) -> None:
+        # keep one failing coroutine from cancelling its siblings
+        try:
+            await coro
+        except Exception:
+            _LOGGER.exception("Error in task group task %s", coro)
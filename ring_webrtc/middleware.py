@@ -69,12 +69,12 @@ class IdleShutdown:
 		"""
 		task_group: TaskWaitGroup = TaskWaitGroup()
 		self._task_groups.add(task_group)
-		_LOGGER.debug(f'Request received. Active requests: {len(self._task_groups)}.')
+		_LOGGER.debug('Request received. Active requests: %d.', len(self._task_groups))
 
 		def create_task(coro: Coroutine):
 			if not task_group in self._task_groups:
 				raise RuntimeError('Task group is already closed.')
-			task_group.add(asyncio.create_task(coro))
+			task_group.add(coro)
 
 		request[CREATE_TASK] = create_task
 
@@ -85,18 +85,19 @@ class IdleShutdown:
 
 			if not task_group:
 				self._task_groups.remove(task_group)
-				_LOGGER.debug(f'Request completed. Active requests: {len(self._task_groups)}.')
+				_LOGGER.debug('Request completed. Active requests: %d.', len(self._task_groups))
 			else:
-				_LOGGER.debug(f'Request handler completed. Task group count: {len(task_group)}.')
-				task_group.add_done_callback(self._task_groups.remove)
-				task_group.run()
+				_LOGGER.debug('Request handler completed. Task group count: %d.', len(task_group))
+				task_group.run().add_done_callback(
+					lambda _: self._task_groups.remove(task_group),
+				)
 
 	async def _monitor_idle(self, app: Application) -> None:
 		"""
 		Loop forever to check for idle timeout and trigger the shutdown callback.
 		"""
 
-		_LOGGER.info(f'Starting idle monitoring for app: {app}.')
+		_LOGGER.info('Starting idle monitoring for app: %s.', app)
 		while True:
 			if len(self._task_groups) > 0:
 				self._last_request_time = now()
@@ -104,7 +105,7 @@ class IdleShutdown:
 			idle_time = now() - self._last_request_time
 
 			if idle_time > self._idle_timeout:
-				_LOGGER.info(f'Idle timeout detected. Triggering shutdown callback for app: {app}.')
+				_LOGGER.info('Idle timeout detected. Triggering shutdown callback for app: %s.', app)
 				try:
 					self._on_idle(app)
 				except Exception:
@@ -112,7 +113,7 @@ class IdleShutdown:
 				return
 
 			sleep_interval = (self._idle_timeout - idle_time).total_seconds()
-			_LOGGER.debug(f'Not idle. Checking again in {sleep_interval} seconds: {app}')
+			_LOGGER.debug('Not idle. Checking again in %s seconds: %s', sleep_interval, app)
 			await asyncio.sleep(sleep_interval)
 
 	def setup(self, app: Application) -> None:
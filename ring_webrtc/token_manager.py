@@ -1,17 +1,147 @@
-from typing import Any
-import json
+from typing import Any, AsyncIterator, Iterator
+from contextlib import asynccontextmanager, contextmanager, suppress
+import asyncio
+import fcntl
+import logging
+import os
 from pathlib import Path
+import stat
+
+import orjson
+from ring_doorbell import Auth
+
+_LOGGER = logging.getLogger(__name__)
 
 
 class TokenManager:
-	def __init__(self, token_file: Path) -> None:
+	def __init__(self, token_file: Path, *, shared: bool = False) -> None:
 		self._token_file = token_file
-		self._token = json.loads(token_file.read_text(encoding="utf-8"))
+		self._shared = shared
+		self._lock_file = token_file.with_name(f'{token_file.name}.lock')
+		self._refresh_lock_file = token_file.with_name(f'{token_file.name}.refresh.lock')
+		self._write_future: asyncio.Future | None = None
+		self._token_bytes = token_file.read_bytes()
+		self._token = orjson.loads(self._token_bytes)
 
 	@property
 	def token(self) -> dict[str, Any]:
 		return self._token
 
+	@contextmanager
+	def _locked(self) -> Iterator[None]:
+		"""
+		Hold an exclusive lock so worker processes don't interleave writes.
+		"""
+		if not self._shared:
+			yield
+			return
+
+		with self._lock_file.open('a') as lock:
+			fcntl.flock(lock, fcntl.LOCK_EX)
+			try:
+				yield
+			finally:
+				fcntl.flock(lock, fcntl.LOCK_UN)
+
+	@asynccontextmanager
+	async def refreshing(self) -> AsyncIterator[None]:
+		"""
+		Hold an exclusive lock across processes for the duration of a token refresh.
+		"""
+		with self._refresh_lock_file.open('a') as lock:
+			await asyncio.get_running_loop().run_in_executor(None, fcntl.flock, lock, fcntl.LOCK_EX)
+			try:
+				yield
+			finally:
+				fcntl.flock(lock, fcntl.LOCK_UN)
+
+	def reload(self) -> bool:
+		"""
+		Pick up a token written by another process. Returns whether it changed.
+		"""
+		token_bytes = self._token_file.read_bytes()
+		if token_bytes == self._token_bytes:
+			return False
+
+		self._token_bytes = token_bytes
+		self._token = orjson.loads(token_bytes)
+		return True
+
+	async def flush(self) -> None:
+		"""
+		Wait for the last scheduled write to finish. Failures are logged by _on_written.
+		"""
+		if self._write_future is not None:
+			with suppress(Exception):
+				await self._write_future
+
 	def update_token(self, token: dict[str, Any]):
 		self._token = token
-		self._token_file.write_text(json.dumps(self._token), encoding="utf-8")
+		self._token_bytes = orjson.dumps(token)
+
+		try:
+			loop = asyncio.get_running_loop()
+		except RuntimeError:
+			self._write()
+		else:
+			self._write_future = loop.run_in_executor(None, self._write)
+			self._write_future.add_done_callback(self._on_written)
+
+	def _on_written(self, future: asyncio.Future) -> None:
+		if not future.cancelled() and (exc := future.exception()) is not None:
+			_LOGGER.error('Failed to write token file "%s"', self._token_file, exc_info=exc)
+
+	def _write(self) -> None:
+		"""
+		Persist the latest token, replacing the file atomically.
+		"""
+		tmp_file = self._token_file.with_name(f'{self._token_file.name}.tmp')
+		with self._locked():
+			# keep the credentials' permissions instead of taking the umask
+			try:
+				mode = stat.S_IMODE(self._token_file.stat().st_mode)
+			except FileNotFoundError:
+				mode = 0o600
+
+			fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+			with os.fdopen(fd, 'wb') as f:
+				os.fchmod(fd, mode)
+				f.write(self._token_bytes)
+				f.flush()
+				os.fsync(fd)
+			tmp_file.replace(self._token_file)
+
+
+class SharedTokenAuth(Auth):
+	"""
+	Ring Auth that shares token refreshes with other worker processes through
+	the token file, so two workers never spend the same refresh token.
+	"""
+
+	def __init__(self, token_manager: TokenManager, **kwargs: Any) -> None:
+		super().__init__(
+			token=token_manager.token,
+			token_updater=token_manager.update_token,
+			**kwargs,
+		)
+		self._token_manager = token_manager
+		self._refresh_lock = asyncio.Lock()
+
+	async def async_refresh_tokens(self) -> dict[str, Any]:
+		expired = self._token
+		async with self._refresh_lock, self._token_manager.refreshing():
+			if self._token is not expired:
+				# refreshed by another request while we waited for the lock
+				return self._token
+
+			if self._token_manager.reload():
+				# another worker refreshed first, adopt its token
+				self._token = self._token_manager.token
+				self._oauth_client.token = self._token
+				self._oauth_client.populate_token_attributes(self._token)
+				return self._token
+
+			token = await super().async_refresh_tokens()
+			# the next worker must read our token, not the one we just spent
+			await self._token_manager.flush()
+			return token